@@ -17,13 +17,18 @@ import streamlit.components.v1 as components
 import pandas as pd
 from io import BytesIO
 from datetime import date, timedelta
+from functools import lru_cache
 from typing import List, Dict, Any
-import json
-import json as _json
-import time, hashlib, re, requests
+import time, hashlib, re, requests, threading, random
+from collections import OrderedDict
+from requests.adapters import HTTPAdapter
+import orjson
 import gspread
+from concurrent.futures import ThreadPoolExecutor
 from google.oauth2.service_account import Credentials
 from gspread.exceptions import APIError
+from gspread.http_client import HTTPClient
+from gspread.utils import absolute_range_name
 
 # =========================
 # HELPERS / ERRORI
@@ -47,26 +52,56 @@ def _safe_int(x, default=0):  # usato in vari punti
     except Exception:
         return default
 
+_TRUE_STRS = frozenset({"true", "1", "yes", "y", "on"})
+
 def _to_bool(x) -> bool:
     """Converte in booleano da varie rappresentazioni ('TRUE','false','1', ecc.)."""
     if isinstance(x, bool):
         return x
     if x is None:
         return False
-    s = str(x).strip().lower()
-    return s in {"true", "1", "yes", "y", "on"}
+    return str(x).strip().lower() in _TRUE_STRS
+
+def _to_bool_series(s: pd.Series) -> pd.Series:
+    """Versione vettoriale di _to_bool per colonne di stringhe (celle Sheets)."""
+    return s.fillna("").astype(str).str.strip().str.lower().isin(_TRUE_STRS)
 
 # =========================
 # ENV & COSTANTI
 # =========================
 ENV = st.secrets.get("env", "prod")
 SPREADSHEET_NAME = "MealPlannerDB_prod" if ENV == "prod" else "MealPlannerDB_dev"
+# opzionale: ID del file (open_by_key evita la ricerca per nome su Drive)
+SPREADSHEET_ID = st.secrets.get("spreadsheet_id", "")
 SHOW_ENV_BANNER = (ENV == "dev")
 
 APP_TITLE = "MealPlanner"
 DAYS_LABELS = ["Lun", "Mar", "Mer", "Gio", "Ven", "Sab", "Dom"]
 MEALS = ["Pranzo", "Cena"]
+MEALS_TUP = tuple(MEALS)
+_DAY_KEYS = frozenset(MEALS) | {"date"}  # chiavi di un giorno del planner normalizzato
 UNITS = ["g", "kg", "ml", "l", "pcs", "tbsp", "tsp"]
+UNIT_INDEX = {u: i for i, u in enumerate(UNITS)}
+RECIPE_HEADERS = ["id","name","category","time","servings","image","description","instructions","ingredients_json","favorite"]
+SLOT_HEADERS = ["week_start","date","meal","recipe_id","servings"]
+# Oltre questa eta' (s) i dati letti/scritti da Sheets in sessione non si considerano allineati al foglio
+# (altri tab/dispositivi): vale per la cache dei valori profilo e per lo snapshot usato dal diff
+_PROFILE_TTL_SEC = 300
+RECIPES_PAGE_SIZE = 12  # ricette per pagina nel ricettario (widget per rerun limitati)
+# unità -> (unità base, fattore) per la lista spesa
+_TO_BASE = {"g":("g",1),"kg":("g",1000),"ml":("ml",1),"l":("ml",1000),"pcs":("pcs",1),"tbsp":("tbsp",1),"tsp":("tsp",1)}
+# come Series: Series.map(Series) non riconverte il dict ad ogni chiamata
+_BASE_UNIT = pd.Series({k: v[0] for k, v in _TO_BASE.items()}, dtype=object)
+_BASE_FACTOR = pd.Series({k: float(v[1]) for k, v in _TO_BASE.items()})
+
+# Regex precompilate (usate a ogni rerun)
+_GDRIVE_ID_RE = re.compile(r"/d/([a-zA-Z0-9_-]{10,})")
+_DROPBOX_DL_RE = re.compile(r"\?dl=[01]")
+# minify CSS: stringhe tra apici (gruppo 1, lasciate intatte) | commenti e spazi (-> un solo spazio)
+_CSS_MIN_RE = re.compile(r"""("(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')|(?:\s|/\*.*?\*/)+""", re.S)
+
+_IMG_MAX_BYTES = 4 * 1024 * 1024  # immagini più grandi: non scaricate (placeholder)
+_PROFILE_SANITIZE_RE = re.compile(r"[^A-Za-z0-9_-]+")
 
 # =========================
 # RERUN compat
@@ -80,6 +115,7 @@ def _rerun():
 # =========================
 # IMMAGINI (download lato server, con cache)
 # =========================
+@lru_cache(maxsize=512)
 def _resolve_image_url(u: str) -> str:
     if not u:
         return u
@@ -89,14 +125,14 @@ def _resolve_image_url(u: str) -> str:
 
     # Google Drive: /file/d/<ID>/view  -> uc?export=view&id=<ID>
     if "drive.google.com" in u:
-        m = re.search(r"/d/([a-zA-Z0-9_-]{10,})", u)
+        m = _GDRIVE_ID_RE.search(u)
         if m:
             return f"https://drive.google.com/uc?export=view&id={m.group(1)}"
 
     # Dropbox: ?dl=0/1 -> ?raw=1
     if "dropbox.com" in u:
         if "?raw=1" not in u:
-            u = u.replace("?dl=0", "?raw=1").replace("?dl=1", "?raw=1")
+            u = _DROPBOX_DL_RE.sub("?raw=1", u)
 
     # Unsplash CDN: auto format jpg
     if "images.unsplash.com" in u:
@@ -107,33 +143,152 @@ def _resolve_image_url(u: str) -> str:
             u += f"{sep}fm=jpg"
     return u
 
-@st.cache_data(show_spinner=False, ttl=60*60*24)
-def _fetch_image_bytes(u: str) -> bytes | None:
-    try:
-        url = _resolve_image_url(u)
-        if not url or not url.startswith("http"):
-            return None
-        r = requests.get(
-            url,
-            headers={
-                "User-Agent": "Mozilla/5.0",
-                "Accept": "image/avif,image/webp,image/apng,image/*,*/*;q=0.8",
-            },
-            timeout=8,
-        )
+@st.cache_resource(show_spinner=False)
+def _http_session() -> requests.Session:
+    """Sessione HTTP condivisa (keep-alive + pool) per i download immagini."""
+    s = requests.Session()
+    s.headers.update({
+        "User-Agent": "Mozilla/5.0",
+        "Accept": "image/avif,image/webp,image/apng,image/*,*/*;q=0.8",
+    })
+    s.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+    return s
+
+class _ImgLRU:
+    """Cache immagini LRU con tetto in byte (thread-safe: la usa anche il prefetch).
+       I download falliti restano "negativi" per FAIL_TTL_SEC, poi si ritenta (al massimo FAIL_MAX voci)."""
+    FAIL_TTL_SEC = 600.0
+    FAIL_MAX = 512
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.cur_bytes = 0
+        self._d: OrderedDict[str, bytes] = OrderedDict()
+        self._failed: OrderedDict[str, float] = OrderedDict()  # in ordine di timestamp
+        self._lock = threading.Lock()
+
+    def failed(self, url: str) -> bool:
+        with self._lock:
+            ts = self._failed.get(url)
+            if ts is None:
+                return False
+            if time.monotonic() - ts < self.FAIL_TTL_SEC:
+                return True
+            del self._failed[url]
+            return False
+
+    def mark_failed(self, url: str):
+        now = time.monotonic()
+        with self._lock:
+            self._failed.pop(url, None)
+            self._failed[url] = now
+            # le più vecchie stanno in testa: via le scadute e l'eccedenza oltre FAIL_MAX
+            while self._failed and (len(self._failed) > self.FAIL_MAX
+                                    or now - next(iter(self._failed.values())) >= self.FAIL_TTL_SEC):
+                self._failed.popitem(last=False)
+
+    def get(self, url: str) -> bytes | None:
+        with self._lock:
+            data = self._d.get(url)
+            if data is not None:
+                self._d.move_to_end(url)
+            return data
+
+    def put(self, url: str, data: bytes):
+        with self._lock:
+            old = self._d.pop(url, None)
+            if old is not None:
+                self.cur_bytes -= len(old)
+            self._d[url] = data
+            self.cur_bytes += len(data)
+            while self.cur_bytes > self.max_bytes and len(self._d) > 1:
+                _, ev = self._d.popitem(last=False)
+                self.cur_bytes -= len(ev)
+
+@st.cache_resource(show_spinner=False)
+def _img_cache() -> _ImgLRU:
+    return _ImgLRU(max_bytes=64 * 1024 * 1024)
+
+def _download_capped(url: str, session: requests.Session, max_bytes: int = _IMG_MAX_BYTES) -> bytes:
+    """GET in streaming: scarta subito le immagini oltre max_bytes (Content-Length o conteggio)."""
+    with session.get(url, timeout=8, stream=True) as r:
         r.raise_for_status()
-        data = r.content
-        return data if data and len(data) >= 32 else None
-    except Exception:
+        if _safe_int(r.headers.get("Content-Length"), 0) > max_bytes:
+            return b""
+        buf = bytearray()
+        for chunk in r.iter_content(chunk_size=64 * 1024):
+            buf += chunk
+            if len(buf) > max_bytes:
+                return b""
+    return bytes(buf) if len(buf) >= 32 else b""
+
+def _fetch_image_bytes(u: str, cache: _ImgLRU | None = None, session: requests.Session | None = None) -> bytes | None:
+    # chiave = URL risolto: link equivalenti (?dl=0 / ?raw=1, http/https, Drive view/uc) -> una sola voce
+    # con cache + session passati non tocca Streamlit: usabile da thread senza ScriptRunContext
+    url = _resolve_image_url(u)
+    if not url:
         return None
+    cache = cache or _img_cache()
+    data = cache.get(url)
+    if data is None:
+        if cache.failed(url):
+            return None  # fallito di recente: niente nuovo tentativo a ogni rerun
+        data = b""
+        try:
+            if url.startswith("http"):
+                data = _download_capped(url, session or _http_session())
+        except Exception:
+            pass
+        if data:
+            cache.put(url, data)
+        else:
+            cache.mark_failed(url)
+    return data or None
+
+def _prefetch_images(urls) -> Dict[str, bytes | None]:
+    """Scarica in parallelo (thread pool) le immagini indicate; ritorna {url: bytes|None}.
+       Cache e sessione HTTP risolte qui: i worker non usano Streamlit (nessun ScriptRunContext)."""
+    cache = _img_cache(); session = _http_session(); out = {}; misses = []
+    # hit in cache servite subito: il pool di thread si crea solo se c'e' davvero da scaricare
+    for u in dict.fromkeys(urls):
+        if not u:
+            continue
+        url = _resolve_image_url(u)
+        data = cache.get(url) if url else None
+        if data is not None or not url or cache.failed(url):
+            out[u] = data or None
+        else:
+            misses.append(u)
+    fetch = lambda u: _fetch_image_bytes(u, cache, session)
+    if len(misses) <= 1:
+        out.update((u, fetch(u)) for u in misses)
+        return out
+    with ThreadPoolExecutor(max_workers=min(8, len(misses))) as ex:
+        out.update(zip(misses, ex.map(fetch, misses)))
+    return out
 
-def _render_image_from_url(url: str):
-    """Scarica e mostra un'immagine; ritorna True se mostrata.
+@st.cache_resource(show_spinner=False)
+def _img_pool() -> ThreadPoolExecutor:
+    """Pool di processo per il pre-riscaldamento immagini in background."""
+    return ThreadPoolExecutor(max_workers=4, thread_name_prefix="img-warm")
+
+def _warm_images(urls):
+    """Avvia (senza attendere) il download delle immagini non ancora in cache.
+       I thread del pool sono condivisi fra sessioni: nessun ScriptRunContext agganciato."""
+    cache = _img_cache(); session = _http_session(); pool = _img_pool()
+    for u in dict.fromkeys(urls):
+        url = _resolve_image_url(u) if u else ""
+        if url and cache.get(url) is None and not cache.failed(url):
+            pool.submit(_fetch_image_bytes, u, cache, session)
+
+def _render_image_from_url(url: str, img: bytes | None = None):
+    """Mostra un'immagine (scaricandola se non passata già in `img`); ritorna True se mostrata.
        Fallback silenzioso per non inquinare la UI con messaggi."""
     if not url:
         st.empty()
         return False
-    img = _fetch_image_bytes(url)
+    if img is None:
+        img = _fetch_image_bytes(url)
     if img:
         st.image(img, use_container_width=True)
         return True
@@ -144,6 +299,24 @@ def _render_image_from_url(url: str):
 # =========================
 # GOOGLE AUTH / SECRETS
 # =========================
+class _BackoffHTTPClient(HTTPClient):
+    """
+    HTTPClient gspread con retry esponenziale (+ jitter) su 408/429/5xx.
+    Tentativi limitati (il BackOffHTTPClient di gspread ritenta all'infinito e blocca la UI).
+    """
+    MAX_ATTEMPTS = 5
+    BASE_SEC = 0.5
+
+    def request(self, *args, **kwargs):
+        for attempt in range(self.MAX_ATTEMPTS):
+            try:
+                return super().request(*args, **kwargs)
+            except APIError as e:
+                retry = e.code in (408, 429) or e.code >= 500
+                if not retry or attempt == self.MAX_ATTEMPTS - 1:
+                    raise
+                time.sleep(self.BASE_SEC * 2**attempt + random.random() * 0.2)
+
 def _normalize_private_key(pk: str) -> str:
     if pk is None:
         return ""
@@ -195,19 +368,41 @@ def _get_sheet_client_and_error():
                 "https://www.googleapis.com/auth/drive.readonly",
             ],
         )
-        client = gspread.authorize(creds)
+        # Backoff: ritenta in automatico 429/5xx (quota 60 write/min)
+        client = gspread.authorize(creds, http_client=_BackoffHTTPClient)
         return client, None
     except Exception as e:
         return None, f"{type(e).__name__}: {e}"
 
+def _sa_fingerprint() -> str:
+    """Impronta dei secrets del service account: chiave delle cache client/spreadsheet."""
+    try:
+        info = dict(st.secrets["gcp_service_account"])
+    except Exception:
+        return ""
+    return _fp(orjson.dumps(info, default=str, option=orjson.OPT_SORT_KEYS))
+
 @st.cache_resource(show_spinner=False)
-def _get_sheet_client_cached():
-    """Client Sheets con cache (uso in load/save)."""
+def _get_sheet_client_cached(sa_fp: str):
+    """Client Sheets con cache per impronta secrets: PEM + OAuth una volta per processo (e a ogni rotazione chiave)."""
     client, _ = _get_sheet_client_and_error()
     return client
 
 def _get_sheet_client():
-    return _get_sheet_client_cached()
+    return _get_sheet_client_cached(_sa_fingerprint())
+
+@st.cache_resource(show_spinner=False)
+def _get_spreadsheet_cached(sa_fp: str):
+    gc = _get_sheet_client_cached(sa_fp)
+    if gc is None:
+        return None
+    if SPREADSHEET_ID:
+        return gc.open_by_key(SPREADSHEET_ID)
+    return gc.open(SPREADSHEET_NAME)
+
+def _get_spreadsheet():
+    """Spreadsheet aperto una volta per processo (niente gc.open ad ogni load/save)."""
+    return _get_spreadsheet_cached(_sa_fingerprint())
 
 def _secrets_healthcheck():
     ok_client, err = _get_sheet_client_and_error()
@@ -221,8 +416,9 @@ def _secrets_healthcheck():
 # =========================
 # PROFILI (worksheet per profilo) + Lista profili persistente
 # =========================
+@lru_cache(maxsize=128)
 def _sheet_name_for(base: str, profile: str) -> str:
-    safe = re.sub(r"[^A-Za-z0-9_-]+", "_", (profile or "Default").strip())
+    safe = _PROFILE_SANITIZE_RE.sub("_", (profile or "Default").strip())
     return f"{base}__{safe}" if safe.lower() != "default" else base
 
 def _get_or_create_ws(sh, title: str, headers: List[str]):
@@ -231,52 +427,134 @@ def _get_or_create_ws(sh, title: str, headers: List[str]):
     except gspread.WorksheetNotFound:
         ws = sh.add_worksheet(title=title, rows=400, cols=max(10, len(headers) or 10))
         if headers:
-            ws.update([headers])
-            try:
-                ws.freeze(rows=1)
-            except Exception:
-                pass
+            # header (RAW) + riga bloccata in un solo batchUpdate invece di update() + freeze()
+            sh.batch_update({"requests": [
+                _update_cells(ws, 0, [headers]),
+                {"updateSheetProperties": {
+                    "properties": {"sheetId": ws.id, "gridProperties": {"frozenRowCount": 1}},
+                    "fields": "gridProperties.frozenRowCount",
+                }},
+            ]})
+    return ws
+
+def _session_ws(sh, title: str, headers: List[str]):
+    """Handle worksheet memorizzato in sessione: niente sh.worksheet (fetch metadata) ad ogni save."""
+    cache = st.session_state.setdefault("_ws_cache", {})
+    ws = cache.get(title)
+    if ws is None:
+        ws = cache[title] = _get_or_create_ws(sh, title, headers)
     return ws
 
+def _rows_to_values(rows: List[dict] | List[list]) -> List[list]:
+    """Normalizza lista di dict (key del primo = headers) o lista di liste in values A1."""
+    if not rows:
+        return []
+    if isinstance(rows[0], dict):
+        headers = list(rows[0].keys())
+        return [headers] + [[row.get(h, "") for h in headers] for row in rows]
+    return rows
+
+def _cell(v) -> dict:
+    """Valore -> CellData (equivalente a valueInputOption=RAW)."""
+    if v is None or v == "":
+        return {}
+    if isinstance(v, bool):
+        return {"userEnteredValue": {"boolValue": v}}
+    if isinstance(v, (int, float)):
+        return {"userEnteredValue": {"numberValue": v}}
+    return {"userEnteredValue": {"stringValue": str(v)}}
+
+def _update_cells(ws, row0: int, rows: List[list]) -> dict:
+    return {"updateCells": {
+        "start": {"sheetId": ws.id, "rowIndex": row0, "columnIndex": 0},
+        "rows": [{"values": [_cell(v) for v in row]} for row in rows],
+        "fields": "userEnteredValue",
+    }}
+
+def _overwrite_requests(ws, values: List[list]) -> List[dict]:
+    """
+    Richieste batchUpdate che riscrivono il worksheet da A1.
+    Se in sessione c'e' uno snapshot recente (< _PROFILE_TTL_SEC, stesse colonne) dell'ultima
+    scrittura manda solo le righe cambiate (+ resize se cambia il numero di righe); altrimenti
+    resize esatto + updateCells completo. Nessun values -> svuota tutte le celle.
+    Lista vuota = nulla da scrivere.
+    Lo snapshot e' cio' che QUESTA sessione ha scritto: se il foglio puo' essere cambiato altrove
+    va invalidato (_forget_written), altrimenti il diff mescolerebbe le due versioni.
+    """
+    if not values:
+        return [{"updateCells": {"range": {"sheetId": ws.id}, "fields": "userEnteredValue"}}]
+    snap = st.session_state.get("_ws_snapshot", {}).get(ws.id)
+    prev = snap[1] if snap and time.monotonic() - snap[0] < _PROFILE_TTL_SEC else None
+    if not prev or len(prev[0]) != len(values[0]):
+        return [
+            {"updateSheetProperties": {
+                "properties": {"sheetId": ws.id, "gridProperties": {"rowCount": len(values), "columnCount": len(values[0])}},
+                "fields": "gridProperties(rowCount,columnCount)",
+            }},
+            _update_cells(ws, 0, values),
+        ]
+    reqs = []
+    if len(values) != len(prev):
+        reqs.append({"updateSheetProperties": {
+            "properties": {"sheetId": ws.id, "gridProperties": {"rowCount": len(values)}},
+            "fields": "gridProperties.rowCount",
+        }})
+    # righe cambiate raggruppate in blocchi contigui
+    start = None
+    for i, row in enumerate(values):
+        changed = i >= len(prev) or row != prev[i]
+        if changed and start is None:
+            start = i
+        elif not changed and start is not None:
+            reqs.append(_update_cells(ws, start, values[start:i])); start = None
+    if start is not None:
+        reqs.append(_update_cells(ws, start, values[start:]))
+    return reqs
+
+def _remember_written(ws, values: List[list]):
+    """Snapshot (per sheetId, in sessione, con istante di scrittura) dell'ultima scrittura riuscita: base per il diff."""
+    st.session_state.setdefault("_ws_snapshot", {})[ws.id] = (time.monotonic(), [list(r) for r in values])
+
+def _forget_written(ws):
+    """Il foglio puo' differire da quanto scritto: il prossimo salvataggio lo riscrive per intero."""
+    st.session_state.get("_ws_snapshot", {}).pop(ws.id, None)
+
 def _safe_update(ws, rows: List[dict] | List[list]):
     """
     Aggiorna un worksheet scrivendo da A1 headers + righe.
     Accetta:
       - lista di dict (usa le key del primo come headers)
       - lista di liste (prima sottolista = headers)
-    Ridimensiona prima per evitare errori di range.
+    Solo le righe cambiate (o resize + scrittura) in un'unica chiamata batchUpdate.
     """
-    if not rows:
+    values = _rows_to_values(rows)
+    if not values:
         ws.clear()
+        _forget_written(ws)
         return
-    if isinstance(rows[0], dict):
-        headers = list(rows[0].keys())
-        values = [headers] + [[row.get(h, "") for h in headers] for row in rows]
-    else:
-        values = rows
-        headers = rows[0] if rows else []
-    ws.resize(rows=len(values), cols=len(headers))
-    ws.update("A1", values, value_input_option="RAW")
+    reqs = _overwrite_requests(ws, values)
+    if reqs:
+        ws.spreadsheet.batch_update({"requests": reqs})
+    _remember_written(ws, values)
 
 def _load_profiles_from_sheet():
-    gc = _get_sheet_client()
-    if gc is None:
+    sh = _get_spreadsheet()
+    if sh is None:
         return
-    sh = gc.open(SPREADSHEET_NAME)
     ws = _get_or_create_ws(sh, "_profiles", ["profile"])
     try:
-        rows = ws.get_all_records()
+        rows = ws.get_all_values()
     except Exception:
         rows = []
-    plist = [r.get("profile", "").strip() for r in rows if r.get("profile")]
+    # prima colonna = "profile" (riga 0 = header): niente dict per riga
+    plist = [str(r[0]).strip() for r in rows[1:] if r and str(r[0]).strip()]
     if plist:
         st.session_state.profiles = sorted(set(["Default"] + plist))
 
 def _save_profiles_to_sheet():
-    gc = _get_sheet_client()
-    if gc is None:
+    sh = _get_spreadsheet()
+    if sh is None:
         return
-    sh = gc.open(SPREADSHEET_NAME)
     ws = _get_or_create_ws(sh, "_profiles", ["profile"])
     rows = [{"profile": p} for p in st.session_state.profiles if p.strip().lower() != "default"]
     _safe_update(ws, rows)
@@ -287,12 +565,11 @@ def delete_profile(profile: str):
         st.warning("Non è possibile eliminare il profilo Default.")
         return
 
-    gc = _get_sheet_client()
-    if gc is None:
+    sh = _get_spreadsheet()
+    if sh is None:
         st.error("Impossibile connettersi a Google Sheets. Controlla i secrets.")
         return
 
-    sh = gc.open(SPREADSHEET_NAME)
     targets = [
         _sheet_name_for("recipes", profile),
         _sheet_name_for("planner_slots", profile),
@@ -308,6 +585,9 @@ def delete_profile(profile: str):
         except Exception as e:
             st.error(f"Errore eliminando '{title}': {e}")
 
+    _invalidate_profile_cache()
+    st.session_state.pop("_slot_rows", None)
+    st.session_state.pop("_ws_cache", None)
     st.session_state.profiles = [p for p in st.session_state.profiles if p != profile]
 
     if st.session_state.get("current_profile") == profile:
@@ -364,34 +644,79 @@ def _demo_recipes():
         },
     ]
 
+@lru_cache(maxsize=64)
+def _week_isos(start: date) -> tuple:
+    """Date ISO dei 7 giorni della settimana (memo per week_start)."""
+    return tuple((start + timedelta(days=i)).isoformat() for i in range(7))
+
 def _empty_week(start: date | None = None):
     if start is None:
         today = date.today()
         start = today - timedelta(days=today.weekday())
     week = {"start": str(start), "days": []}
-    for i in range(7):
-        d = start + timedelta(days=i)
-        week["days"].append({"date": str(d), **{m: {"recipe_id": None, "servings": 2} for m in MEALS}})
+    for d in _week_isos(start):
+        week["days"].append({"date": d, **{m: {"recipe_id": None, "servings": 2} for m in MEALS}})
     return week
 
+def _reindex_recipes():
+    """Ricostruisce l'indice id -> ricetta; da chiamare dopo ogni modifica alla lista."""
+    st.session_state.recipes_by_id = {r["id"]: r for r in st.session_state.recipes}
+    st.session_state._max_recipe_id = max(st.session_state.recipes_by_id, default=0)
+    # lista sostituita (load, import, demo): gli id possono indicare altre ricette
+    st.session_state.pop("_ings_df", None)
+    _touch_recipes()
+
+def _touch_recipes():
+    """Nuova versione delle ricette (lista o contenuto cambiati): invalida i derivati memoizzati."""
+    st.session_state._recipes_version = st.session_state.get("_recipes_version", 0) + 1
+
+def _add_recipe(rec: dict):
+    """Aggiunge una ricetta aggiornando l'indice in O(1) (niente reindex completo)."""
+    if "recipes_by_id" not in st.session_state:
+        _reindex_recipes()
+    st.session_state.recipes.append(rec)
+    st.session_state.recipes_by_id[rec["id"]] = rec
+    st.session_state._max_recipe_id = max(st.session_state._max_recipe_id, rec["id"])
+    _touch_recipes()
+
+def _remove_recipe(rid):
+    """Rimuove una ricetta: pop dall'indice, max id ricalcolato solo se era il massimo."""
+    if "recipes_by_id" not in st.session_state:
+        _reindex_recipes()
+    rec = st.session_state.recipes_by_id.pop(rid, None)
+    if rec is None:
+        return
+    # pop in place (una scansione per identità, niente copia della lista)
+    recipes = st.session_state.recipes
+    idx = next((i for i, x in enumerate(recipes) if x is rec), None)
+    if idx is not None:
+        recipes.pop(idx)
+    else:  # indice non allineato alla lista: filtro per id
+        st.session_state.recipes = [x for x in recipes if x["id"] != rid]
+    if rid == st.session_state._max_recipe_id:
+        st.session_state._max_recipe_id = max(st.session_state.recipes_by_id, default=0)
+    st.session_state.get("_ings_df", {}).pop(rid, None)
+    _touch_recipes()
+
 def _find_recipe(rid):
     if rid is None:
         return None
-    for r in st.session_state.recipes:
-        if r["id"] == rid:
-            return r
-    return None
+    if "recipes_by_id" not in st.session_state:
+        _reindex_recipes()
+    return st.session_state.recipes_by_id.get(rid)
 
 def _get_new_recipe_id() -> int:
-    return (max((r["id"] for r in st.session_state.recipes), default=0) + 1)
-
-def _get_new_recipe_id_from(used: set[int]) -> int:
-    m = max(used) if used else 0
-    return m + 1
+    if "_max_recipe_id" not in st.session_state:
+        _reindex_recipes()
+    return st.session_state._max_recipe_id + 1
 
 def _normalize_planner_meal_keys(planner, expected_meals):
     if not planner or "days" not in planner:
         return planner
+    # fast path: chiavi già normalizzate (caso comune dopo la prima chiamata); dict_keys == set senza copie
+    needed=_DAY_KEYS if expected_meals is MEALS else frozenset(expected_meals) | {"date"}
+    if all(d.keys()==needed for d in planner["days"]):
+        return planner
     synonyms = {"lunch":"Pranzo","dinner":"Cena","pranzo":"Pranzo","cena":"Cena"}
     new_days=[]
     for day in planner.get("days", []):
@@ -411,8 +736,13 @@ def _normalize_planner_meal_keys(planner, expected_meals):
 def _init_state():
     st.session_state.setdefault("profiles", ["Default"])
     st.session_state.setdefault("current_profile", "Default")
-    st.session_state.setdefault("recipes", _demo_recipes())
-    st.session_state.setdefault("planner", _empty_week())
+    # niente setdefault(k, f()): f() verrebbe valutata ad ogni rerun anche con la chiave presente
+    if "recipes" not in st.session_state:
+        st.session_state.recipes = _demo_recipes()
+    if "recipes_by_id" not in st.session_state:
+        _reindex_recipes()
+    if "planner" not in st.session_state:
+        st.session_state.planner = _empty_week()
     if "week_start" not in st.session_state:
         today = date.today()
         st.session_state.week_start = today - timedelta(days=today.weekday())
@@ -425,30 +755,125 @@ def _init_state():
 # =========================
 # PERSISTENZA planner (debounced)
 # =========================
-def _planner_fingerprint(planner: dict) -> str:
-    canon=[]
-    for d in planner.get("days", []):
-        row={"date": d["date"]}
-        for meal,slot in d.items():
-            if meal=="date": continue
-            row[meal]={"recipe_id":slot.get("recipe_id"),"servings":slot.get("servings",2)}
-        canon.append(row)
-    return hashlib.sha256(_json.dumps(canon, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
-
-def _save_planner_if_changed(debounce_sec: float = 2.0):
+def _fp(b: bytes) -> str:
+    """Hash non crittografico per change-detection (blake2b 128 bit, più rapido di sha256)."""
+    return hashlib.blake2b(b, digest_size=16).hexdigest()
+
+def _planner_fingerprint(planner: dict) -> int:
+    # hash() della tupla piatta (data, pasto, ricetta, porzioni): confronto solo in-processo, niente serializzazione
+    return hash(tuple(
+        (d["date"], meal, slot.get("recipe_id"), slot.get("servings",2))
+        for d in planner.get("days", []) for meal,slot in d.items() if meal!="date"
+    ))
+
+def _mark_planner_dirty():
+    """Callback dei widget planner: incrementa la versione da salvare."""
+    st.session_state._planner_dirty_version = st.session_state.get("_planner_dirty_version", 0) + 1
+
+def _save_planner_if_changed(debounce_sec: float = 2.0, profile: str | None = None):
     if "planner" not in st.session_state:
         return
+    # O(1) sui rerun senza modifiche: nessuna nuova versione dai widget
+    version=st.session_state.get("_planner_dirty_version", 0)
+    if version==st.session_state.get("_last_saved_version", 0):
+        return
+    last_ts=st.session_state.get("_last_saved_ts",float("-inf"))
+    now=time.monotonic()
+    if (now-last_ts)<debounce_sec:
+        return
     fp=_planner_fingerprint(st.session_state.planner)
-    last_fp=st.session_state.get("_last_saved_planner_fp"); last_ts=st.session_state.get("_last_saved_ts",0.0)
-    now=time.time()
-    if fp!=last_fp and (now-last_ts)>=debounce_sec:
-        try:
-            save_to_sheets()
-            st.session_state["_last_saved_planner_fp"]=fp
-            st.session_state["_last_saved_ts"]=now
-            st.toast("Planner salvato ✓")
-        except Exception as e:
-            st.warning(f"Impossibile salvare: {e}")
+    if fp==st.session_state.get("_last_saved_planner_fp"):
+        st.session_state["_last_saved_version"]=version
+        return
+    try:
+        save_to_sheets(profile)
+        st.session_state["_last_saved_planner_fp"]=fp
+        st.session_state["_last_saved_ts"]=now
+        st.session_state["_last_saved_version"]=version
+        st.toast("Planner salvato ✓")
+    except Exception as e:
+        st.warning(f"Impossibile salvare: {e}")
+
+# =========================
+# PERSISTENZA ricette (debounced)
+# =========================
+def _recipes_fingerprint(recipes: list) -> str:
+    return _fp(orjson.dumps(recipes, option=orjson.OPT_SORT_KEYS))
+
+def _recipes_filter_frame() -> pd.DataFrame:
+    """Colonne usate dai filtri del ricettario (minuscole / numeriche) + elenco categorie.
+       Memoizzati sulla versione ricette (_touch_recipes): minuscole calcolate solo alle scritture."""
+    fp=st.session_state.get("_recipes_version", 0)
+    if st.session_state.get("_filter_fp")!=fp or "_filter_df" not in st.session_state:
+        recs=st.session_state.recipes
+        st.session_state["_filter_df"]=pd.DataFrame({
+            "name": pd.Series([r.get("name") or "" for r in recs], dtype=str).str.lower(),
+            "description": pd.Series([r.get("description") or "" for r in recs], dtype=str).str.lower(),
+            "category": pd.Series([r.get("category") for r in recs], dtype=object),
+            "time": pd.to_numeric(pd.Series([r.get("time",0) for r in recs], dtype=object), errors="coerce").fillna(0),
+        })
+        st.session_state["_filter_categories"]=sorted({(r.get("category") or "").strip() for r in recs if r.get("category")})
+        st.session_state["_filter_fp"]=fp
+    return st.session_state["_filter_df"]
+
+def _ingredients_frame(r: dict) -> pd.DataFrame:
+    """DataFrame ingredienti di una ricetta, ricostruito solo se la lista ingredienti cambia (nuovo oggetto al salvataggio)."""
+    ings=r.get("ingredients", [])
+    cache=st.session_state.setdefault("_ings_df", {})
+    hit=cache.get(r["id"])
+    # la cache tiene un riferimento alla lista: il suo id() non puo' essere riciclato, confronto per identità sicuro;
+    # le voci per id ricetta vengono svuotate da _reindex_recipes/_remove_recipe
+    if hit is None or hit[0] is not ings:
+        hit=cache[r["id"]]=(ings, pd.DataFrame(ings))
+    return hit[1]
+
+def _recipe_select_options() -> tuple:
+    """(label->id, id->label, opzioni select con "-", label->indice) per il planner, memoizzati su _recipes_version."""
+    ver=st.session_state.get("_recipes_version", 0)
+    cached=st.session_state.get("_select_opts")
+    if cached is None or cached[0]!=ver:
+        opts_map={f'{r["name"]} · {r.get("time","-")} min': r["id"] for r in st.session_state.recipes}
+        id_to_label={v:k for k,v in opts_map.items()}
+        # current deriva da id_to_label (o è "-"), quindi è sempre tra le opzioni: stessa tupla per tutte le celle
+        base_opts=("-", *opts_map)
+        cached=st.session_state["_select_opts"]=(ver, opts_map, id_to_label, base_opts, {lbl: i for i, lbl in enumerate(base_opts)})
+    return cached[1:]
+
+def _save_recipes_if_changed(profile: str | None = None):
+    """Salva subito le ricette se cambiate dall'ultimo salvataggio (nessun debounce: niente modifiche perse)."""
+    if "recipes" not in st.session_state:
+        return
+    # O(1) se nessuna scrittura dall'ultimo controllo (niente fingerprint su tutte le ricette)
+    ver=st.session_state.get("_recipes_version", 0)
+    if ver==st.session_state.get("_recipes_synced_version"):
+        return
+    fp=_recipes_fingerprint(st.session_state.recipes)
+    if "_last_saved_recipes_fp" not in st.session_state:
+        # primo giro: lo stato appena caricato e' gia' quello su Sheets
+        st.session_state["_last_saved_recipes_fp"]=fp
+    if fp==st.session_state["_last_saved_recipes_fp"]:
+        st.session_state["_recipes_synced_version"]=ver
+        return
+    try:
+        save_to_sheets(profile)
+        st.session_state["_last_saved_recipes_fp"]=fp
+        st.session_state["_recipes_synced_version"]=ver
+        st.toast("Ricette salvate su Google Sheets ✓")
+    except APIError as e:
+        st.error(f"Google Sheets APIError: {_gs_errmsg(e)}")
+    except Exception as e:
+        st.error(f"Salvataggio non riuscito: {e}")
+
+def _flush_pending(profile: str | None = None) -> bool:
+    """
+    Salva subito planner e ricette in sospeso (profile=None -> profilo corrente).
+    True se non resta nulla da salvare: chi poi ricarica da Sheets non perde modifiche.
+    """
+    _save_planner_if_changed(debounce_sec=0, profile=profile)
+    _save_recipes_if_changed(profile)
+    ss=st.session_state
+    return (ss.get("_planner_dirty_version", 0)==ss.get("_last_saved_version", 0)
+            and ss.get("_recipes_version", 0)==ss.get("_recipes_synced_version"))
 
 # =========================
 # LISTA SPESA (profilo + settimana)
@@ -457,200 +882,317 @@ def _week_key():
     return f"{st.session_state.get('current_profile','Default')}::{st.session_state.week_start.isoformat()}"
 
 def _aggregate_shopping_list_from_planner() -> pd.DataFrame:
-    to_base={"g":("g",1),"kg":("g",1000),"ml":("ml",1),"l":("ml",1000),"pcs":("pcs",1),"tbsp":("tbsp",1),"tsp":("tsp",1)}
-    agg={}
+    cols=["Ingrediente","Quantità","Unità"]
+    # scala totale per ricetta (una ricetta in più slot -> ingredienti letti una volta sola)
+    scales={}
     for d in st.session_state.planner["days"]:
-        for meal in MEALS:
-            slot=d[meal]; rid=slot.get("recipe_id"); serv=slot.get("servings",0)
-            rec=_find_recipe(rid)
-            if not rec: continue
-            base=max(1, rec.get("servings",1)); scale=(serv or 0)/base
-            for ing in rec.get("ingredients", []):
-                name=str(ing.get("name","")).strip().title()
-                if not name: continue
-                unit=str(ing.get("unit","")).lower(); qty=float(ing.get("qty",0))*scale
-                base_u,f=to_base.get(unit,(unit,1)); qty_b=qty*f
-                agg[(name,base_u)]=agg.get((name,base_u),0)+qty_b
-    rows=[]
-    for (name,bu),qtyb in agg.items():
-        if bu=="g" and qtyb>=1000: rows.append({"Ingrediente":name,"Quantità":round(qtyb/1000,2),"Unità":"kg"})
-        elif bu=="ml" and qtyb>=1000: rows.append({"Ingrediente":name,"Quantità":round(qtyb/1000,2),"Unità":"l"})
-        else: rows.append({"Ingrediente":name,"Quantità":round(qtyb,2),"Unità":bu})
-    rows.sort(key=lambda x:(x["Ingrediente"],x["Unità"]))
-    return pd.DataFrame(rows) if rows else pd.DataFrame(columns=["Ingrediente","Quantità","Unità"])
-
-def _ensure_week_checklist():
-    wk=_week_key(); df=_aggregate_shopping_list_from_planner()
+        for meal in MEALS_TUP:
+            slot=d[meal]; rid=slot.get("recipe_id")
+            if rid is None: continue
+            scales[rid]=scales.get(rid,0.0)+(slot.get("servings",0) or 0)
+    records=[]
+    for rid,serv in scales.items():
+        rec=_find_recipe(rid)
+        if not rec: continue
+        scale=serv/max(1, rec.get("servings",1))
+        records.extend((ing.get("name",""), ing.get("unit",""), ing.get("qty",0), scale) for ing in rec.get("ingredients", []))
+    if not records:
+        return pd.DataFrame(columns=cols)
+    # normalizzazione + conversione in unità base, tutto vettoriale
+    raw=pd.DataFrame.from_records(records, columns=["name","unit","qty","scale"])
+    name=raw["name"].astype(str).str.strip().str.title()
+    unit=raw["unit"].astype(str).str.lower()
+    df=pd.DataFrame({
+        "name": name,
+        "base_unit": unit.map(_BASE_UNIT).fillna(unit),
+        "qty_base": pd.to_numeric(raw["qty"]).astype(float)*raw["scale"]*unit.map(_BASE_FACTOR).fillna(1),
+    })[name.ne("")]
+    if df.empty:
+        return pd.DataFrame(columns=cols)
+    # somma vettoriale per (ingrediente, unità base)
+    agg=df.groupby(["name","base_unit"], as_index=False, sort=False)["qty_base"].sum()
+    # g→kg / ml→l oltre 1000
+    big_g=agg["base_unit"].eq("g") & agg["qty_base"].ge(1000)
+    big_ml=agg["base_unit"].eq("ml") & agg["qty_base"].ge(1000)
+    agg.loc[big_g | big_ml, "qty_base"] /= 1000
+    agg.loc[big_g, "base_unit"]="kg"
+    agg.loc[big_ml, "base_unit"]="l"
+    out=pd.DataFrame({"Ingrediente": agg["name"], "Quantità": agg["qty_base"].round(2), "Unità": agg["base_unit"]})
+    return out.sort_values(["Ingrediente","Unità"], ignore_index=True)
+
+def _shopping_fingerprint() -> int:
+    """Fingerprint di planner + ricette: ogni scrittura sulle ricette incrementa _recipes_version."""
+    return hash((_planner_fingerprint(st.session_state.planner), st.session_state.get("_recipes_version", 0)))
+
+def _shopping_list_df(fp: int | None = None) -> pd.DataFrame:
+    """Aggregazione memoizzata: ricalcola solo se planner o ricette cambiano."""
+    if fp is None: fp=_shopping_fingerprint()
+    if st.session_state.get("_shopping_fp")!=fp:
+        st.session_state["_shopping_df"]=_aggregate_shopping_list_from_planner()
+        st.session_state["_shopping_fp"]=fp
+    return st.session_state["_shopping_df"].copy()
+
+def _ensure_week_checklist() -> str:
+    """Allinea la checklist della settimana corrente alla lista spesa; ritorna la week key."""
+    wk=_week_key(); fp=_shopping_fingerprint()
     st.session_state.setdefault("shopping_checklists", {})
+    built=st.session_state.setdefault("_checklist_fp", {})
+    cur=st.session_state.shopping_checklists.get(wk)
+    if cur is not None and built.get(wk)==fp:
+        # lista invariata: niente merge né riordino (le modifiche del data_editor sono posizionali)
+        return wk
+    built[wk]=fp; df=_shopping_list_df(fp)
     if df.empty:
         st.session_state.shopping_checklists[wk]=[]
-        return
-    cur=st.session_state.shopping_checklists.get(wk)
+        return wk
     if not cur:
         df["Comprato"]=False
-        st.session_state.shopping_checklists[wk]=df.to_dict("records")
     else:
         prev={(r["Ingrediente"],r["Unità"]): r.get("Comprato",False) for r in cur}
-        df["Comprato"]=df.apply(lambda r: prev.get((r["Ingrediente"],r["Unità"]),False), axis=1)
-        st.session_state.shopping_checklists[wk]=df.to_dict("records")
-    # ordina: comprati in fondo
-    recs = st.session_state.shopping_checklists[wk]
-    recs.sort(key=lambda r: (r.get("Comprato", False), r["Ingrediente"], r["Unità"]))
-    st.session_state.shopping_checklists[wk] = recs
+        # MultiIndex dalle due colonne (niente copia del frame come con set_index) + map in C
+        df["Comprato"]=pd.MultiIndex.from_arrays([df["Ingrediente"], df["Unità"]]).map(prev).fillna(False).astype(bool)
+    # ordina solo alla costruzione (comprati in fondo); l'ordine resta fisso finché la lista non cambia
+    df=df.sort_values(["Comprato","Ingrediente","Unità"])
+    st.session_state.shopping_checklists[wk]=df.to_dict("records")
+    return wk
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def _shopping_excel(records: tuple) -> bytes:
+    """Excel della lista spesa; records = tuple di (Ingrediente, Quantità, Unità, Comprato)."""
+    df=pd.DataFrame(list(records), columns=["Ingrediente","Quantità","Unità","Comprato"])
+    buf=BytesIO()
+    with pd.ExcelWriter(buf, engine="xlsxwriter") as w:
+        df.to_excel(w, index=False, sheet_name="ShoppingList")
+    return buf.getvalue()
 
 def _render_shopping_list_ui(embed: bool=True):
-    _ensure_week_checklist()
-    wk=_week_key(); recs=st.session_state.shopping_checklists[wk]
+    wk=_ensure_week_checklist(); recs=st.session_state.shopping_checklists[wk]
     if embed:
         st.subheader("🧾 Lista della spesa — settimana corrente")
         st.caption(f"{st.session_state.week_start.strftime('%d/%m/%Y')} → {(st.session_state.week_start + timedelta(days=6)).strftime('%d/%m/%Y')}")
-    for idx, row in enumerate(recs):
-        # card con bordo e checkbox più facile da toccare
-        with st.container(border=True):
-            cols = [0.18, 0.52, 0.15, 0.15] if st.session_state.get("is_mobile") else [0.14, 0.56, 0.15, 0.15]
-            c = st.columns(cols)
-            with c[0]:
-                bought = st.checkbox(" ", value=row.get("Comprato", False), key=f"buy_{wk}_{idx}")
-            with c[1]:
-                st.write(f"**{row['Ingrediente']}**")
-            with c[2]:
-                st.write(row["Quantità"])
-            with c[3]:
-                st.write(row["Unità"])
-            recs[idx]["Comprato"] = bought
-
-    df=pd.DataFrame(recs)
-    buf=BytesIO()
-    with pd.ExcelWriter(buf, engine="xlsxwriter") as w:
-        df.to_excel(w, index=False, sheet_name="ShoppingList")
+    # un solo data_editor (spunta "Comprato") invece di 4 widget per riga
+    edited=st.data_editor(
+        pd.DataFrame(recs, columns=["Comprato","Ingrediente","Quantità","Unità"]),
+        # chiave legata alla versione della lista: dopo una ricostruzione le modifiche posizionali non si riapplicano
+        key=f"shop_editor_{wk}_{st.session_state._checklist_fp[wk]}", hide_index=True, use_container_width=True,
+        column_config={"Comprato": st.column_config.CheckboxColumn("✓")},
+        disabled=["Ingrediente","Quantità","Unità"],
+    )
+    recs=edited[["Ingrediente","Quantità","Unità","Comprato"]].to_dict("records")
+    st.session_state.shopping_checklists[wk]=recs
 
-    # Solo export Excel (CSV rimosso)
+    if not recs:
+        st.caption("Nessun ingrediente per questa settimana.")
+        return
+    # Solo export Excel (CSV rimosso); workbook ricostruito solo se la lista cambia
+    xlsx=_shopping_excel(tuple(edited[["Ingrediente","Quantità","Unità","Comprato"]].itertuples(index=False, name=None)))
     st.markdown('<div class="sticky-bottom">', unsafe_allow_html=True)
-    st.download_button("⬇️ Excel", buf.getvalue(), "shopping_list.xlsx", use_container_width=True)
+    st.download_button("⬇️ Excel", xlsx, "shopping_list.xlsx", use_container_width=True)
     st.markdown('</div>', unsafe_allow_html=True)
 
 # =========================
 # GOOGLE SHEETS: LOAD / SAVE (profilo) — SAFE
 # =========================
+def _read_ws_values(sh, title: str, headers: List[str]) -> List[list]:
+    """Tutte le celle di una worksheet (get_all_values), creandola se manca."""
+    return _get_or_create_ws(sh, title, headers).get_all_values()
+
+def _read_many_ws_values(sh, sheets: List[tuple]) -> List[List[list]]:
+    """
+    Valori di più worksheet [(title, headers), ...] con un solo values.batchGet.
+    Se una worksheet manca (range non valido) ripiega sulla lettura singola, che la crea.
+    """
+    try:
+        res = sh.values_batch_get([absolute_range_name(title) for title, _ in sheets])
+        return [vr.get("values", []) for vr in res.get("valueRanges", [])]
+    except APIError:
+        return [_read_ws_values(sh, title, headers) for title, headers in sheets]
+
+def _values_frame(values: List[list], headers: List[str]) -> pd.DataFrame:
+    """values (prima riga = headers) -> DataFrame di stringhe con tutte le colonne attese."""
+    if values:
+        width=len(values[0])
+        df=pd.DataFrame([(row+[""]*width)[:width] for row in values[1:]], columns=values[0])
+    else:
+        df=pd.DataFrame(columns=headers)
+    for h in headers:
+        if h not in df.columns: df[h]=""
+    return df
+
+def _parse_ingredients(s) -> list:
+    # celle vuote / non-lista: niente parse né eccezione (solo "[...]" è valido)
+    s = str(s or "").strip()
+    if not s.startswith("["):
+        return []
+    try:
+        return orjson.loads(s)
+    except Exception:
+        return []
+
+@st.cache_data(ttl=_PROFILE_TTL_SEC, show_spinner=False)
+def _fetch_profile_values(profile: str) -> tuple[List[list], List[list], float]:
+    """Valori grezzi (ricette, planner_slots) di un profilo in un solo round-trip + istante di lettura (monotonic)."""
+    return (*_read_many_ws_values(_get_spreadsheet(), [
+        (_sheet_name_for("recipes",profile), RECIPE_HEADERS),
+        (_sheet_name_for("planner_slots",profile), SLOT_HEADERS),
+    ]), time.monotonic())
+
+@st.cache_data(ttl=_PROFILE_TTL_SEC, show_spinner=False)
+def _fetch_profile_data(profile: str, wk_start: date) -> tuple[list, dict]:
+    """
+    Legge e converte (ricette, planner della settimana) di un profilo.
+    Solo dati: nessun accesso a session_state. Cambiare settimana non rilegge Sheets
+    (valori grezzi in cache per profilo). Cache svuotate da _invalidate_profile_cache.
+    """
+    recipe_values, slot_values, _ = _fetch_profile_values(profile)
+
+    # --- Ricette (parsing vettoriale)
+    df=_values_frame(recipe_values, RECIPE_HEADERS)
+    df["time"]=pd.to_numeric(df["time"], errors="coerce").fillna(0).astype(int)
+    df["servings"]=pd.to_numeric(df["servings"], errors="coerce").fillna(0).astype(int).replace(0, 2)
+    df["favorite"]=_to_bool_series(df["favorite"])
+    df["ingredients"]=df["ingredients_json"].map(_parse_ingredients)
+    recipes=df[["id","name","category","time","servings","image","description","instructions","ingredients","favorite"]].to_dict("records")
+    # id mancanti/duplicati -> nuovo id = max corrente + 1 (max tenuto incrementale, niente O(R²))
+    used_ids = set(); max_id = 0
+    for r in recipes:
+        rid = _safe_int(r["id"])
+        if not rid or rid in used_ids:
+            rid = max_id + 1
+        used_ids.add(rid); max_id = max(max_id, rid)
+        r["id"] = rid
+
+    # --- Planner: SOLO settimana richiesta
+    planner=_empty_week(wk_start)
+    by_date={iso: i for i, iso in enumerate(_week_isos(wk_start))}
+    # filtro vettoriale sullo storico: solo le righe della settimana passano al loop Python
+    sdf=_values_frame(slot_values, SLOT_HEADERS)
+    sdf["date"]=sdf["date"].astype(str).str.strip()
+    sdf["meal"]=sdf["meal"].astype(str).str.strip()
+    wk=sdf[sdf["date"].isin(list(by_date)) & sdf["meal"].isin(MEALS_TUP)]
+
+    # colonne zippate: niente dict per riga; slot scritti direttamente nel giorno (date, meal)
+    days=planner["days"]
+    for d, meal, rid, serv in zip(wk["date"], wk["meal"], wk["recipe_id"], wk["servings"]):
+        rid=_safe_int(rid) if str(rid).strip() else None
+        days[by_date[d]][meal]={"recipe_id":rid,"servings":_safe_int(serv) or 2}
+
+    return recipes, planner
+
+def _slot_rows_from_values(values: List[list]) -> List[list]:
+    """Righe planner_slots (ordine SLOT_HEADERS) dai valori grezzi; recipe_id/servings tornano numerici."""
+    rows = _values_frame(values, SLOT_HEADERS)[SLOT_HEADERS].values.tolist()
+    for r in rows:
+        r[3] = _safe_int(r[3]) if str(r[3]).strip() else ""
+        r[4] = _safe_int(r[4]) if str(r[4]).strip() else ""
+    return rows
+
+def _invalidate_profile_cache():
+    """Da chiamare dopo ogni scrittura su Sheets (save/delete profilo)."""
+    _fetch_profile_values.clear()
+    _fetch_profile_data.clear()
+
 def load_from_sheets():
-    gc=_get_sheet_client()
-    if gc is None:
+    sh=_get_spreadsheet()
+    if sh is None:
         st.warning("Caricamento da Google Sheets non disponibile (credenziali mancanti o non valide).")
         return
-    sh=gc.open(SPREADSHEET_NAME)
     prof=st.session_state.get("current_profile","Default")
+    st.session_state["_loaded_profile"]=prof  # profilo a cui appartengono i dati in sessione
 
-    # --- Ricette
-    ws_recipes=_get_or_create_ws(
-        sh, _sheet_name_for("recipes",prof),
-        ["id","name","category","time","servings","image","description","instructions","ingredients_json","favorite"]
-    )
-    rows=ws_recipes.get_all_records()
-    st.session_state.recipes=[]
-    used_ids = set()
-    for r in rows:
-        try:
-            ings=json.loads(r.get("ingredients_json","[]"))
-        except Exception:
-            ings=[]
-        rid = _safe_int(r.get("id",0))
-        if not rid or rid in used_ids:
-            rid = _get_new_recipe_id_from(used_ids)
-        used_ids.add(rid)
-        st.session_state.recipes.append({
-            "id": rid,
-            "name": r.get("name",""), "category": r.get("category",""),
-            "time": _safe_int(r.get("time",0)), "servings": _safe_int(r.get("servings",2)) or 2,
-            "image": r.get("image",""), "description": r.get("description",""),
-            "instructions": r.get("instructions",""), "ingredients": ings,
-            "favorite": _to_bool(r.get("favorite", False)),
-        })
+    recipes, planner = _fetch_profile_data(prof, st.session_state.week_start)
+    _, slot_values, fetched_at = _fetch_profile_values(prof)
+    st.session_state["_slot_rows"] = (prof, _slot_rows_from_values(slot_values), fetched_at)
+    # dopo un load il primo salvataggio riscrive tutto (il foglio puo' essere cambiato altrove)
+    st.session_state.pop("_ws_snapshot", None)
 
     # Se non ci sono ricette, popola con demo per evitare UI “vuota”
-    if not st.session_state.recipes:
-        st.session_state.recipes = _demo_recipes()
-
-    # --- Planner: SOLO settimana corrente
-    ws_slots=_get_or_create_ws(sh, _sheet_name_for("planner_slots",prof), ["week_start","date","meal","recipe_id","servings"])
-    slots=ws_slots.get_all_records()
-    wk_start=st.session_state.week_start
-    planner=_empty_week(wk_start)
-    by_date={(wk_start + timedelta(days=i)).isoformat(): i for i in range(7)}
-
-    for s in slots:
-        d=str(s.get("date","")).strip()
-        if not d or d not in by_date: continue
-        i=by_date[d]
-        meal=str(s.get("meal","")).strip()
-        if meal not in MEALS: continue
-        rid=_safe_int(s.get("recipe_id")) if str(s.get("recipe_id","")).strip() else None
-        serv=_safe_int(s.get("servings",2)) or 2
-        planner["days"][i][meal]={"recipe_id":rid,"servings":serv}
-
+    st.session_state.recipes = recipes or _demo_recipes()
+    _reindex_recipes()
+    # solo cio' che si vede subito: ricette della settimana + prima pagina del ricettario
+    _warm_images([(_find_recipe(d[m].get("recipe_id")) or {}).get("image") for d in planner["days"] for m in MEALS_TUP]
+                 + [r.get("image") for r in st.session_state.recipes[:RECIPES_PAGE_SIZE]])
+    # fingerprint di cio' che e' in sessione (anche il set demo): nessun autosave delle demo senza modifiche
+    st.session_state["_last_saved_recipes_fp"]=_recipes_fingerprint(st.session_state.recipes)
     st.session_state.planner=planner
     st.success(f"✅ Dati caricati per profilo: {prof}")
 
-def save_to_sheets():
-    gc = _get_sheet_client()
-    if gc is None:
+def save_to_sheets(profile: str | None = None):
+    """Salva ricette + settimana corrente nel profilo indicato (default: profilo corrente)."""
+    sh = _get_spreadsheet()
+    if sh is None:
         st.warning("Salvataggio su Google Sheets non disponibile (credenziali mancanti o non valide).")
         return
 
-    sh = gc.open(SPREADSHEET_NAME)
-    prof = st.session_state.get("current_profile", "Default")
+    prof = profile or st.session_state.get("current_profile", "Default")
 
     try:
         # ----- RICETTE (overwrite intero profilo)
-        ws_recipes = _get_or_create_ws(
-            sh, _sheet_name_for("recipes", prof),
-            ["id","name","category","time","servings","image","description","instructions","ingredients_json","favorite"]
+        ws_recipes = _session_ws(
+            sh, _sheet_name_for("recipes", prof), RECIPE_HEADERS
         )
-        rows_recipes = [{
-            "id": r["id"],
-            "name": r.get("name",""),
-            "category": r.get("category",""),
-            "time": int(r.get("time",0) or 0),
-            "servings": int(r.get("servings",2) or 2),
-            "image": r.get("image",""),
-            "description": r.get("description",""),
-            "instructions": r.get("instructions",""),
-            "ingredients_json": json.dumps(r.get("ingredients", []), ensure_ascii=False),
-            "favorite": "TRUE" if bool(r.get("favorite", False)) else "FALSE",
-        } for r in st.session_state.get("recipes", [])]
-        _safe_update(ws_recipes, rows_recipes)
+        values_recipes = [RECIPE_HEADERS] + [[
+            r["id"],
+            r.get("name",""),
+            r.get("category",""),
+            int(r.get("time",0) or 0),
+            int(r.get("servings",2) or 2),
+            r.get("image",""),
+            r.get("description",""),
+            r.get("instructions",""),
+            orjson.dumps(r.get("ingredients", [])).decode(),
+            "TRUE" if bool(r.get("favorite", False)) else "FALSE",
+        ] for r in st.session_state.get("recipes", [])]
 
         # ----- PLANNER (storico preservato: sostituisce solo la settimana corrente)
-        ws_slots = _get_or_create_ws(
-            sh, _sheet_name_for("planner_slots", prof),
-            ["week_start","date","meal","recipe_id","servings"]
+        ws_slots = _session_ws(
+            sh, _sheet_name_for("planner_slots", prof), SLOT_HEADERS
         )
 
-        existing = ws_slots.get_all_records()
+        # storico dalla sessione (letto al load, aggiornato a ogni save) solo se recente: oltre
+        # _PROFILE_TTL_SEC si rilegge il foglio, perche' altri tab/dispositivi possono aver salvato
+        # altre settimane. Entro la finestra le righe delle altre settimane sono last-writer-wins.
+        cached = st.session_state.get("_slot_rows")
+        if cached and cached[0] == prof and time.monotonic() - cached[2] < _PROFILE_TTL_SEC:
+            existing = cached[1]
+        else:
+            existing = _slot_rows_from_values(ws_slots.get_all_values())
+            _forget_written(ws_slots)  # il foglio puo' differire dallo snapshot: riscrittura completa
         wk_start = st.session_state.week_start
-        week_dates = {(wk_start + timedelta(days=i)).isoformat() for i in range(7)}
-
-        kept = [row for row in existing if str(row.get("date","")).strip() not in week_dates]
-
-        new_slots = []
-        for d in st.session_state.get("planner", {}).get("days", []):
-            the_date = d["date"]
-            for meal, slot in d.items():
-                if meal == "date":
-                    continue
-                new_slots.append({
-                    "week_start": st.session_state.week_start.isoformat(),
-                    "date": the_date,
-                    "meal": meal,
-                    "recipe_id": slot.get("recipe_id"),
-                    "servings": slot.get("servings", 2),
-                })
-
-        combined = kept + new_slots
-        _safe_update(ws_slots, combined)
+        week_dates = frozenset(_week_isos(wk_start))
+
+        wk_iso = wk_start.isoformat()
+        week_rows = {
+            (d["date"], meal): [wk_iso, d["date"], meal, d[meal].get("recipe_id"), d[meal].get("servings", 2)]
+            for d in st.session_state.get("planner", {}).get("days", []) for meal in MEALS_TUP
+        }
+        # righe della settimana sostituite AL LORO POSTO (row[1]=date, row[2]=meal): lo storico non
+        # scorre, quindi il diff con lo snapshot manda solo gli slot cambiati; le nuove vanno in coda
+        values_slots = [SLOT_HEADERS]
+        for row in existing:
+            if str(row[1]).strip() not in week_dates:
+                values_slots.append(row)
+            else:
+                new = week_rows.pop((str(row[1]).strip(), str(row[2]).strip()), None)
+                if new is not None:
+                    values_slots.append(new)
+        values_slots += week_rows.values()
+
+        # Un solo batchUpdate per entrambe le worksheet (solo righe cambiate)
+        reqs = _overwrite_requests(ws_recipes, values_recipes) + _overwrite_requests(ws_slots, values_slots)
+        if reqs:
+            sh.batch_update({"requests": reqs})
+        _remember_written(ws_recipes, values_recipes)
+        _remember_written(ws_slots, values_slots)
+        st.session_state["_slot_rows"] = (prof, values_slots[1:], time.monotonic())
+        _invalidate_profile_cache()
+        st.session_state["_last_saved_recipes_fp"]=_recipes_fingerprint(st.session_state.get("recipes", []))
 
         st.toast(f"Dati salvati (storico preservato) per profilo: {prof} ✓")
 
     except APIError as e:
+        # handle forse non piu' valido (foglio rimosso/rinominato altrove): si riapre al prossimo save
+        st.session_state.pop("_ws_cache", None)
         st.error(f"Errore Google Sheets: {_gs_errmsg(e)}")
         raise
     except Exception as e:
@@ -659,29 +1201,20 @@ def save_to_sheets():
 
 def _sheets_write_probe():
     """Prova di scrittura: aggiunge una riga con timestamp in un foglio '_diagnostics'."""
-    gc = _get_sheet_client()
-    if gc is None:
+    sh = _get_spreadsheet()
+    if sh is None:
         raise RuntimeError("Client Google Sheets non disponibile (controlla i secrets).")
-    sh = gc.open(SPREADSHEET_NAME)
     ws = _get_or_create_ws(sh, "_diagnostics", ["ts", "note"])
     ws.append_row([time.strftime("%Y-%m-%d %H:%M:%S"), "probe write OK"], value_input_option="RAW")
 
 # =========================
 # UI BASE / STILI
 # =========================
-st.set_page_config(page_title=APP_TITLE, page_icon="🍳", layout="wide")
-st.markdown("""
-<style>
-.block-container { padding-top: 1.2rem; padding-bottom: 2rem; }
+# CSS come costanti di modulo. Va riemesso a ogni rerun: Streamlit rimuove gli
+# elementi non ridisegnati, quindi un'iniezione "una tantum" perderebbe gli stili.
+_BASE_CSS = """
 section[data-testid="stSidebar"] { width: 320px; border-right: 1px solid rgba(255,255,255,0.06); }
 [data-testid="stHeader"] { background: transparent; }
-div.stButton > button, div.stDownloadButton > button, a[kind="link"] {
-  border-radius: 12px; padding: .5rem 1rem; font-weight: 600; border: 1px solid rgba(255,255,255,0.12);
-}
-div[data-baseweb="select"] > div { border-radius: 10px !important; min-height: 40px; }
-input[type="text"], input[type="number"], textarea, .st-af { border-radius: 10px !important; }
-/* immagini: fit e bordo */
-.stImage > img { object-fit: cover; width: 100%; max-height: 220px; border-radius: 12px; }
 
 /* container border: fallback generico, evita classi Emotion */
 div[role="region"][tabindex="0"] { padding: .6rem; }
@@ -690,18 +1223,9 @@ div[role="region"][tabindex="0"] { padding: .6rem; }
 @media (max-width: 640px){
   .stButton>button, .stDownloadButton>button { width: 100%; }
 }
-</style>
-""", unsafe_allow_html=True)
+"""
 
-# --- Mobile mode (toggle) + CSS mobile-first
-if "is_mobile" not in st.session_state:
-    st.session_state.is_mobile = False  # puoi metterlo True se pubblichi solo per smartphone
-
-with st.sidebar:
-    st.toggle("📱 Modalità mobile", key="is_mobile", help="Usa layout verticale, bottoni più grandi, meno scroll")
-
-st.markdown("""
-<style>
+_MOBILE_CSS = """
 /* spacing generali */
 .block-container { padding-top: .6rem; padding-bottom: 1.2rem; }
 
@@ -710,9 +1234,6 @@ st.markdown("""
   section[data-testid="stSidebar"] { width: 280px !important; min-width: 280px !important; }
 }
 
-/* header trasparente già presente */
-[data-testid="stHeader"] { background: transparent; }
-
 /* pulsanti e select: touch-friendly */
 div.stButton > button, div.stDownloadButton > button, a[kind="link"] {
   border-radius: 12px; padding: .8rem 1rem; font-weight: 600; border: 1px solid rgba(255,255,255,0.12);
@@ -741,8 +1262,21 @@ input[type="text"], input[type="number"], textarea, .st-af { border-radius: 12px
   }
   .sticky-bottom > div > button { width: 100% !important; }
 }
-</style>
-""", unsafe_allow_html=True)
+"""
+
+# Un solo <style>: le regole base che il blocco touch-friendly ridefiniva sono state tolte.
+# Minificato una volta all'import (via commenti e spazi, stringhe tra apici intatte): payload e parse markdown più leggeri a ogni rerun
+_CSS = "<style>" + _CSS_MIN_RE.sub(lambda m: m.group(1) if m.group(1) is not None else " ", _BASE_CSS + _MOBILE_CSS).strip() + "</style>"
+
+st.set_page_config(page_title=APP_TITLE, page_icon="🍳", layout="wide")
+st.markdown(_CSS, unsafe_allow_html=True)
+
+# --- Mobile mode (toggle); il CSS mobile-first è già in _CSS
+if "is_mobile" not in st.session_state:
+    st.session_state.is_mobile = False  # puoi metterlo True se pubblichi solo per smartphone
+
+with st.sidebar:
+    st.toggle("📱 Modalità mobile", key="is_mobile", help="Usa layout verticale, bottoni più grandi, meno scroll")
 
 _init_state()
 
@@ -771,6 +1305,12 @@ with st.sidebar:
         del st.session_state["_clear_new_profile"]
 
     def _on_profile_change():
+        # qui current_profile e' gia' il nuovo: le modifiche in sospeso vanno salvate nel profilo di prima
+        old=st.session_state.get("_loaded_profile")
+        if old and old!=st.session_state.current_profile and not _flush_pending(old):
+            st.session_state.current_profile=old
+            st.warning(f"Modifiche non salvate nel profilo '{old}': cambio profilo annullato.")
+            return
         try:
             load_from_sheets()
             st.toast("Profilo caricato ✓")
@@ -786,7 +1326,9 @@ with st.sidebar:
     with np_c2:
         if st.button("Crea"):
             name = (new_profile_name or "").strip()
-            if name:
+            if name and not _flush_pending():
+                st.warning("Modifiche non salvate nel profilo corrente: riprova prima di crearne uno nuovo.")
+            elif name:
                 if name not in st.session_state.profiles:
                     st.session_state.profiles.append(name)
                 st.session_state.current_profile = name
@@ -843,12 +1385,15 @@ if page == "Pianificatore settimanale":
     nb = st.columns([1, 3, 1])
     with nb[0]:
         if st.button("◀︎", use_container_width=True, key="nav_prev"):
-            _save_planner_if_changed(debounce_sec=0)  # flush prima di cambiare settimana
-            st.session_state.week_start -= timedelta(days=7)
-            try:
-                load_from_sheets()
-            except Exception:
-                st.session_state.planner = _empty_week(st.session_state.week_start)
+            # flush prima di cambiare settimana: load_from_sheets sovrascrive planner e ricette
+            if not _flush_pending():
+                st.warning("Modifiche non salvate: cambio settimana annullato.")
+            else:
+                st.session_state.week_start -= timedelta(days=7)
+                try:
+                    load_from_sheets()
+                except Exception:
+                    st.session_state.planner = _empty_week(st.session_state.week_start)
     with nb[1]:
         st.caption(
             f"Settimana: {st.session_state.week_start.strftime('%d/%m/%Y')} - "
@@ -856,81 +1401,94 @@ if page == "Pianificatore settimanale":
         )
     with nb[2]:
         if st.button("▶︎", use_container_width=True, key="nav_next"):
-            _save_planner_if_changed(debounce_sec=0)  # flush prima di cambiare settimana
-            st.session_state.week_start += timedelta(days=7)
-            try:
-                load_from_sheets()
-            except Exception:
-                st.session_state.planner = _empty_week(st.session_state.week_start)
+            # flush prima di cambiare settimana: load_from_sheets sovrascrive planner e ricette
+            if not _flush_pending():
+                st.warning("Modifiche non salvate: cambio settimana annullato.")
+            else:
+                st.session_state.week_start += timedelta(days=7)
+                try:
+                    load_from_sheets()
+                except Exception:
+                    st.session_state.planner = _empty_week(st.session_state.week_start)
+
+    # Opzioni ricette memoizzate sulla versione ricette (ricostruite solo dopo una scrittura)
+    opts_map, id_to_label, base_opts, opt_index = _recipe_select_options()
+    # date e suffissi chiave dei 7 giorni calcolati una volta (non per cella)
+    day_dates = [st.session_state.week_start + timedelta(days=i) for i in range(7)]
+    key_sfx = [[f"{i}_{meal}_{d.isoformat()}" for meal in MEALS] for i, d in enumerate(day_dates)]
+    # giorni del planner in una locale: ogni st.session_state.x passa dal proxy di sessione
+    days = st.session_state.planner["days"]
+
+    # Immagini delle ricette pianificate scaricate in parallelo prima del render
+    images = _prefetch_images(
+        (_find_recipe(d[m].get("recipe_id")) or {}).get("image") for d in days for m in MEALS
+    )
 
-    # Precalcolo opzioni ricette (come prima)
-    recipes = st.session_state.recipes
-    opts_map = {f'{r["name"]} · {r.get("time","-")} min': r["id"] for r in recipes}
-    id_to_label = {v:k for k,v in opts_map.items()}
-    base_opts = ["-"] + list(opts_map.keys())
-
-    # --- DESKTOP: 7 colonne come già facevi
-    if not st.session_state.is_mobile:
-        day_cols = st.columns([0.5,1,1,1,1,1,1,1,0.5])[1:-1]
-        for i, col in enumerate(day_cols):
-            d = st.session_state.week_start + timedelta(days=i)
-            with col:
-                st.markdown(f"### {DAYS_LABELS[i]}\n**{d.day}**")
-                for meal in MEALS:
-                    slot = st.session_state.planner["days"][i][meal]
+    # Griglia in una form: le modifiche ai 28 widget arrivano insieme con "Applica"
+    with st.form("planner_week", clear_on_submit=False, border=False):
+        # --- DESKTOP: 7 colonne come già facevi
+        if not st.session_state.is_mobile:
+            day_cols = st.columns([0.5,1,1,1,1,1,1,1,0.5])[1:-1]
+            for i, col in enumerate(day_cols):
+                d = day_dates[i]
+                with col:
+                    st.markdown(f"### {DAYS_LABELS[i]}\n**{d.day}**")
+                    for j, meal in enumerate(MEALS):
+                        slot = days[i][meal]
+                        current = "-" if not slot.get("recipe_id") else id_to_label.get(slot["recipe_id"], "-")
+                        sel_key="planner_sel_"+key_sfx[i][j]
+                        serv_key="planner_serv_"+key_sfx[i][j]
+                        selected = st.selectbox(meal, base_opts, index=opt_index.get(current, 0), key=sel_key, label_visibility="visible")
+                        if selected != "-":
+                            slot["recipe_id"] = opts_map.get(selected, slot.get("recipe_id"))
+                            rec=_find_recipe(slot["recipe_id"])
+                            if rec:
+                                with st.expander("Dettagli", expanded=False):
+                                    _render_image_from_url(rec.get("image"), images.get(rec.get("image")))
+                                    st.caption(f"⏱ {rec['time']} min · Categoria: {rec.get('category','-')}")
+                                    st.write(rec.get("description",""))
+                                slot["servings"] = st.number_input("Porzioni", 1, 12, value=slot.get("servings",2), key=serv_key)
+                        else:
+                            slot["recipe_id"]=None
+
+        # --- MOBILE: lista verticale per giorno con accordion compatti
+        else:
+            for i in range(7):
+                d = day_dates[i]
+                st.markdown(f"### {DAYS_LABELS[i]} · **{d.day}**")
+                for j, meal in enumerate(MEALS):
+                    slot = days[i][meal]
                     current = "-" if not slot.get("recipe_id") else id_to_label.get(slot["recipe_id"], "-")
-                    opts = base_opts if current == "-" else (["-"] + ([current] if current not in base_opts else []) + [o for o in base_opts if o != current and o != "-"])
-                    sel_key=f"planner_sel_{i}_{meal}_{d.isoformat()}"
-                    serv_key=f"planner_serv_{i}_{meal}_{d.isoformat()}"
-                    selected = st.selectbox(meal, opts, index=opts.index(current) if current in opts else 0, key=sel_key, label_visibility="visible")
+                    sel_key="m_planner_sel_"+key_sfx[i][j]
+                    serv_key="m_planner_serv_"+key_sfx[i][j]
+
+                    # riga compatta: titolo pasto + select + stepper porzioni in linea
+                    c1, c2 = st.columns([2, 1])
+                    with c1:
+                        selected = st.selectbox(
+                            f"{meal}", base_opts, index=opt_index.get(current, 0),
+                            key=sel_key, label_visibility="visible"
+                        )
+                    with c2:
+                        slot["servings"] = st.number_input("Porz.", 1, 12, value=slot.get("servings",2), key=serv_key, label_visibility="visible")
+
                     if selected != "-":
                         slot["recipe_id"] = opts_map.get(selected, slot.get("recipe_id"))
-                        rec=_find_recipe(slot["recipe_id"])
+                        rec = _find_recipe(slot["recipe_id"])
                         if rec:
-                            with st.expander("Dettagli", expanded=False):
-                                _render_image_from_url(rec.get("image"))
+                            with st.expander("Dettagli ricetta"):
+                                _render_image_from_url(rec.get("image"), images.get(rec.get("image")))
                                 st.caption(f"⏱ {rec['time']} min · Categoria: {rec.get('category','-')}")
-                                st.write(rec.get("description",""))
-                            slot["servings"] = st.number_input("Porzioni", 1, 12, value=slot.get("servings",2), key=serv_key)
+                                if rec.get("description"): st.write(rec.get("description"))
                     else:
-                        slot["recipe_id"]=None
+                        slot["recipe_id"] = None
 
-    # --- MOBILE: lista verticale per giorno con accordion compatti
-    else:
-        for i in range(7):
-            d = st.session_state.week_start + timedelta(days=i)
-            st.markdown(f"### {DAYS_LABELS[i]} · **{d.day}**")
-            for meal in MEALS:
-                slot = st.session_state.planner["days"][i][meal]
-                current = "-" if not slot.get("recipe_id") else id_to_label.get(slot["recipe_id"], "-")
-                opts = base_opts if current == "-" else (["-"] + ([current] if current not in base_opts else []) + [o for o in base_opts if o != current and o != "-"])
-                sel_key=f"m_planner_sel_{i}_{meal}_{d.isoformat()}"
-                serv_key=f"m_planner_serv_{i}_{meal}_{d.isoformat()}"
-
-                # riga compatta: titolo pasto + select + stepper porzioni in linea
-                c1, c2 = st.columns([2, 1])
-                with c1:
-                    selected = st.selectbox(
-                        f"{meal}", opts, index=opts.index(current) if current in opts else 0,
-                        key=sel_key, label_visibility="visible"
-                    )
-                with c2:
-                    slot["servings"] = st.number_input("Porz.", 1, 12, value=slot.get("servings",2), key=serv_key, label_visibility="visible")
-
-                if selected != "-":
-                    slot["recipe_id"] = opts_map.get(selected, slot.get("recipe_id"))
-                    rec = _find_recipe(slot["recipe_id"])
-                    if rec:
-                        with st.expander("Dettagli ricetta"):
-                            _render_image_from_url(rec.get("image"))
-                            st.caption(f"⏱ {rec['time']} min · Categoria: {rec.get('category','-')}")
-                            if rec.get("description"): st.write(rec.get("description"))
-                else:
-                    slot["recipe_id"] = None
+                st.divider()
 
-            st.divider()
+        submitted = st.form_submit_button("Applica", use_container_width=True, on_click=_mark_planner_dirty)
 
-    _save_planner_if_changed()
+    # submit esplicito = salvataggio immediato; altrimenti autosave con debounce
+    _save_planner_if_changed(debounce_sec=0 if submitted else 2.0)
 
     # Lista spesa: su mobile chiusa di default + azioni sticky in basso
     with st.expander("🧾 Lista della spesa (settimana corrente)", expanded=not st.session_state.is_mobile):
@@ -956,16 +1514,13 @@ elif page == "Ricette":
     mode=st.session_state.recipe_form_mode
     editing=_find_recipe(st.session_state.editing_recipe_id) if mode=="edit" else None
 
-    def _form_prefix(): return f"rf_{mode}_{st.session_state.editing_recipe_id or 'new'}"
-    cur_prefix=_form_prefix()
-
-    # reset state dei widget rf_* quando cambia il form
-    if st.session_state.get("_active_form_prefix") != cur_prefix:
-        for k in list(st.session_state.keys()):
-            if isinstance(k,str) and k.startswith("rf_"):
-                try: del st.session_state[k]
-                except Exception: pass
-        st.session_state["_active_form_prefix"]=cur_prefix
+    # reset dei widget quando cambia il form: nuova epoca nel prefisso -> chiavi nuove,
+    # quelle vecchie non vengono più renderizzate e Streamlit le scarta (niente scan di session_state)
+    form_base=f"{mode}_{st.session_state.editing_recipe_id or 'new'}"
+    if st.session_state.get("_active_form_base") != form_base:
+        st.session_state["_rf_epoch"]=st.session_state.get("_rf_epoch",0)+1
+        st.session_state["_active_form_base"]=form_base
+    cur_prefix=f"rf_{st.session_state['_rf_epoch']}_{form_base}"
 
     defaults = editing.get("ingredients", []) if editing else []
 
@@ -1001,7 +1556,7 @@ elif page == "Ricette":
                 d = defaults[idx] if idx < len(defaults) else {"name": "", "qty": 0, "unit": UNITS[0]}
                 name_i = c1.text_input(f"Ingrediente {idx+1} - nome", value=d.get("name",""), key=f"{cur_prefix}_ing_name_{idx}")
                 qty_i  = c2.number_input(f"Quantità {idx+1}", min_value=0.0, value=float(d.get("qty",0)), key=f"{cur_prefix}_ing_qty_{idx}")
-                unit_i = c3.selectbox(f"Unità {idx+1}", UNITS, index=(UNITS.index(d.get("unit")) if d.get("unit") in UNITS else 0), key=f"{cur_prefix}_ing_unit_{idx}")
+                unit_i = c3.selectbox(f"Unità {idx+1}", UNITS, index=UNIT_INDEX.get(d.get("unit"), 0), key=f"{cur_prefix}_ing_unit_{idx}")
                 if name_i:
                     ingredients.append({"name": name_i, "qty": qty_i, "unit": unit_i})
 
@@ -1026,20 +1581,12 @@ elif page == "Ricette":
                 }
                 if mode=="edit" and editing:
                     editing.update(payload)
+                    _touch_recipes()
                     st.success(f"Ricetta '{name}' aggiornata.")
                 else:
                     payload["id"]=_get_new_recipe_id()
-                    st.session_state.recipes.append(payload)
+                    _add_recipe(payload)
                     st.success(f"Ricetta '{name}' aggiunta.")
-                # Autosave su Sheets
-                try:
-                    save_to_sheets()
-                    st.toast("Ricette salvate su Google Sheets ✓")
-                except APIError as e:
-                    st.error(f"Google Sheets APIError: {_gs_errmsg(e)}")
-                except Exception as e:
-                    st.error(f"Salvataggio non riuscito: {e}")
-
                 st.session_state.recipe_form_mode="add"
                 st.session_state.editing_recipe_id=None
 
@@ -1047,12 +1594,8 @@ elif page == "Ricette":
             clone = dict(editing)
             clone["id"] = _get_new_recipe_id()
             clone["name"] = f"{editing['name']} (copia)"
-            st.session_state.recipes.append(clone)
-            try:
-                save_to_sheets()
-                st.toast("Ricetta clonata ✓")
-            except Exception as e:
-                st.error(f"Salvataggio non riuscito: {e}")
+            _add_recipe(clone)
+            st.toast("Ricetta clonata ✓")
 
         if new_btn:
             st.session_state.recipe_form_mode="add"
@@ -1068,38 +1611,54 @@ elif page == "Ricette":
     st.divider()
 
     # ---------- FILTRI ----------
-    f1,f2,f3=st.columns([2,1,1])
-    text_query=f1.text_input("Cerca per nome/descrizione","")
-    categories=sorted({r.get("category","").strip() for r in st.session_state.recipes if r.get("category")})
-    cat=f2.selectbox("Categoria", ["Tutte"]+categories)
-    max_time=f3.number_input("Tempo max (min)", min_value=0, value=0)
-
-    def _passes_filters(r):
-        if text_query:
-            q=text_query.lower()
-            if q not in r.get("name","").lower() and q not in r.get("description","").lower():
-                return False
-        if cat!="Tutte" and r.get("category")!=cat:
-            return False
-        if max_time and _safe_int(r.get("time",0))>max_time:
-            return False
-        return True
-
-    filtered=[r for r in st.session_state.recipes if _passes_filters(r)]
+    # filtro vettoriale su colonne pre-normalizzate (ricostruite solo se le ricette cambiano)
+    fdf=_recipes_filter_frame()
+    # in una form: digitare non fa rerun, i filtri si applicano con il submit (valori tenuti tra i rerun)
+    with st.form("recipe_filters", border=False):
+        f1,f2,f3=st.columns([2,1,1])
+        text_query=f1.text_input("Cerca per nome/descrizione","")
+        cat=f2.selectbox("Categoria", ["Tutte"]+st.session_state["_filter_categories"])
+        max_time=f3.number_input("Tempo max (min)", min_value=0, value=0)
+        st.form_submit_button("Applica filtri", use_container_width=st.session_state.is_mobile)
+
+    mask=pd.Series(True, index=fdf.index)
+    q=text_query.lower()
+    if q:
+        mask&=fdf["name"].str.contains(q, regex=False) | fdf["description"].str.contains(q, regex=False)
+    if cat!="Tutte":
+        mask&=fdf["category"].eq(cat)
+    if max_time:
+        mask&=fdf["time"].le(max_time)
+    recipes=st.session_state.recipes
+    filtered=[recipes[i] for i in mask.to_numpy().nonzero()[0]]
     st.caption(f"{len(filtered)} ricette trovate")
 
-    # ---------- LISTA ----------
-    for r in filtered:
+    # ---------- LISTA (paginata) ----------
+    # si disegna solo una pagina: container/immagini/expander per rerun non crescono col ricettario
+    n_pages=max(1, -(-len(filtered)//RECIPES_PAGE_SIZE))
+    if st.session_state.get("_recipe_filter_key")!=(q, cat, max_time):
+        st.session_state["_recipe_filter_key"]=(q, cat, max_time)
+        st.session_state.recipe_page=0  # nuovi filtri -> prima pagina
+    pg=min(st.session_state.get("recipe_page", 0), n_pages-1)
+    st.session_state.recipe_page=pg
+    page_recs=filtered[pg*RECIPES_PAGE_SIZE:(pg+1)*RECIPES_PAGE_SIZE]
+
+    def _go_recipe_page(p: int):
+        st.session_state.recipe_page=p
+
+    # immagini della pagina scaricate in parallelo prima del loop (N download ~ 1 RTT)
+    images = _prefetch_images(r.get("image") for r in page_recs)
+    for r in page_recs:
         with st.container(border=True):
             c1,c2=st.columns([1,2])
             with c1:
-                _render_image_from_url(r.get("image"))
+                _render_image_from_url(r.get("image"), images.get(r.get("image")))
             with c2:
                 st.subheader(r["name"])
                 st.caption(f"Categoria: {r.get('category','-')} · ⏱ {r.get('time','-')} min · Porzioni base: {r.get('servings','-')}")
                 if r.get("description"): st.write(r["description"])
                 with st.expander("Ingredienti", expanded=not st.session_state.is_mobile):
-                    df = pd.DataFrame(r.get("ingredients", []))
+                    df = _ingredients_frame(r)
                     if not df.empty:
                         st.dataframe(df, hide_index=True, use_container_width=True)
                 
@@ -1114,7 +1673,15 @@ elif page == "Ricette":
                     st.session_state.scroll_to_form=True
                     _rerun()
                 if b2.button("🗑️ Elimina", key=f"del_{r['id']}"):
-                    st.session_state.recipes=[x for x in st.session_state.recipes if x["id"]!=r["id"]]
-                    try: save_to_sheets()
-                    except Exception: pass
+                    _remove_recipe(r["id"])
                     st.toast(f"Ricetta '{r['name']}' eliminata")
+
+    if n_pages>1:
+        p1,p2,p3=st.columns([1,2,1])
+        p1.button("◀︎", key="recipe_prev", disabled=pg==0, on_click=_go_recipe_page, args=(pg-1,), use_container_width=True)
+        p2.caption(f"Pagina {pg+1} di {n_pages}")
+        p3.button("▶︎", key="recipe_next", disabled=pg>=n_pages-1, on_click=_go_recipe_page, args=(pg+1,), use_container_width=True)
+
+    # Autosave ricette: flush immediato a fine rerun, dopo il render della lista (modifiche
+    # multiple nello stesso rerun -> una scrittura; week/profilo/chiusura non le perdono)
+    _save_recipes_if_changed()